@@ -0,0 +1,78 @@
+"""Chunk types streamed from the OpenAI handler to the client."""
+from dataclasses import dataclass, field
+from typing import Any, Dict, Union
+import orjson
+
+# Fixed framing for assistant text, so only the content needs encoding
+ASSISTANT_PREFIX = b'{"type":"assistant","content":'
+ASSISTANT_SUFFIX = b"}"
+
+
+@dataclass(slots=True)
+class AssistantChunk:
+    """A piece of assistant text."""
+    type: str = field(default="assistant", init=False)
+    content: str
+
+
+@dataclass(slots=True)
+class ToolCallChunk:
+    """Announces a tool call requested by the model."""
+    type: str = field(default="tool_call", init=False)
+    content: str
+    metadata: Dict[str, Any]
+
+
+@dataclass(slots=True)
+class ToolResultChunk:
+    """Progress or output of a tool call."""
+    type: str = field(default="tool_result", init=False)
+    content: str
+    metadata: Dict[str, Any]
+
+
+@dataclass(slots=True)
+class CompleteChunk:
+    """Marks the end of a response."""
+    type: str = field(default="complete", init=False)
+    content: str = ""
+
+
+@dataclass(slots=True)
+class ToolsUpdatedChunk:
+    """Tells the client a server's tool list changed."""
+    type: str = field(default="tools_updated", init=False)
+    content: str = ""
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass(slots=True)
+class ClearedChunk:
+    """Confirms the conversation history was cleared."""
+    type: str = field(default="cleared", init=False)
+
+
+@dataclass(slots=True)
+class ErrorChunk:
+    """Reports a failure handling a client message."""
+    type: str = field(default="error", init=False)
+    content: str
+
+
+Chunk = Union[
+    AssistantChunk,
+    ToolCallChunk,
+    ToolResultChunk,
+    CompleteChunk,
+    ToolsUpdatedChunk,
+    ClearedChunk,
+    ErrorChunk,
+]
+
+
+def encode_chunk(chunk: Chunk) -> bytes:
+    """Serialize a chunk to UTF-8 JSON."""
+    if type(chunk) is AssistantChunk:
+        # Common case while text streams: orjson only escapes the string
+        return ASSISTANT_PREFIX + orjson.dumps(chunk.content) + ASSISTANT_SUFFIX
+    return orjson.dumps(chunk)
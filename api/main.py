@@ -1,16 +1,25 @@
 """FastAPI server with WebSocket support for MCP client."""
 import os
-import json
-from typing import List, Dict, Any
+import asyncio
+from contextlib import aclosing
+from typing import Dict, Any
+import orjson
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from mcp_manager import get_manager
 from openai_handler import OpenAIHandler
+from chunks import ClearedChunk, ErrorChunk, ToolsUpdatedChunk
+from prompt_buffer import PromptBuffer, load_encoding
+from websocket_writer import WebSocketWriter
 
 load_dotenv()
 
+# A client that cannot accept a frame within this window is disconnected
+# rather than stalling token generation indefinitely
+SLOW_CLIENT_TIMEOUT = 10.0  # seconds
+
 app = FastAPI()
 
 # CORS middleware
@@ -24,6 +33,8 @@ app.add_middleware(
 
 # Initialize handlers
 openai_handler: OpenAIHandler | None = None
+# Background task connecting the configured MCP servers
+connect_task: asyncio.Task | None = None
 
 
 @app.on_event("startup")
@@ -33,20 +44,31 @@ async def startup():
     if not api_key:
         raise ValueError("OPENAI_API_KEY environment variable not set")
     
-    global openai_handler
+    global openai_handler, connect_task
     openai_handler = OpenAIHandler(api_key)
     
-    # Connect to all configured MCP servers
+    # Load the tokenizer up front so the first message never waits on a download
+    await load_encoding(openai_handler.model)
+    
+    # Connect to all configured MCP servers in the background so the API
+    # can serve requests while servers are still starting up
     manager = get_manager()
-    await manager.connect_all()
+    connect_task = asyncio.create_task(manager.connect_all())
 
 
 @app.on_event("shutdown")
 async def shutdown():
     """Clean up MCP connections on shutdown."""
+    # Cancelling the connect task also stops servers that are still starting
+    if connect_task and not connect_task.done():
+        connect_task.cancel()
+        try:
+            await connect_task
+        except asyncio.CancelledError:
+            pass
+    
     manager = get_manager()
-    for server_name in manager.get_servers():
-        await manager.disconnect_server(server_name)
+    await manager.disconnect_all()
 
 
 @app.get("/api/servers")
@@ -64,6 +86,14 @@ async def get_servers():
                 "tools": tools.get(server_name, []),
             }
             for server_name in servers
+        ] + [
+            {
+                "name": server_name,
+                "connected": False,
+                "connecting": True,
+                "tools": tools.get(server_name, []),
+            }
+            for server_name in manager.get_connecting_servers()
         ]
     }
 
@@ -98,52 +128,66 @@ async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for streaming chat."""
     await websocket.accept()
     
-    conversation_history: List[Dict[str, Any]] = []
+    prompt = PromptBuffer()
+    # Streamed chunks go through a background writer so a slow client
+    # does not hold up consumption of the OpenAI stream
+    writer = WebSocketWriter(websocket, send_timeout=SLOW_CLIENT_TIMEOUT)
+    
+    # Let the client know when live tools replace the cached ones
+    def on_tools_updated(server_name: str):
+        writer.post(ToolsUpdatedChunk(metadata={"server_name": server_name}))
+    
+    manager = get_manager()
+    manager.add_tools_listener(on_tools_updated)
     
     try:
         while True:
             # Receive message from client
             data = await websocket.receive_text()
-            message_data = json.loads(data)
+            message_data = orjson.loads(data)
             
             if message_data.get("type") == "message":
                 user_message = message_data.get("content", "")
                 
                 if not openai_handler:
-                    await websocket.send_json({
-                        "type": "error",
-                        "content": "OpenAI handler not initialized"
-                    })
+                    await writer.send(ErrorChunk("OpenAI handler not initialized"))
+                    await writer.flush()
                     continue
                 
-                # Update conversation history with user message
-                conversation_history.append({"role": "user", "content": user_message})
-                
-                # Process message with streaming
-                final_messages = []
-                async for chunk in openai_handler.process_message(conversation_history):
-                    await websocket.send_json(chunk)
-                    # Track final messages for history
-                    if chunk.get("type") == "assistant" and chunk.get("content"):
-                        if not final_messages:
-                            final_messages.append({"role": "assistant", "content": ""})
-                        final_messages[0]["content"] += chunk["content"]
-                
-                # Update conversation history with assistant response
-                if final_messages:
-                    conversation_history.append(final_messages[0])
+                # Process message with streaming; closing the generator early
+                # also closes the upstream OpenAI stream
+                try:
+                    # Stage the user message; the handler commits the turn once it completes
+                    await prompt.stage({"role": "user", "content": user_message})
+                    
+                    async with aclosing(openai_handler.process_message(prompt)) as chunks:
+                        async for chunk in chunks:
+                            await writer.send(chunk)
+                    await writer.flush()
+                except asyncio.TimeoutError:
+                    prompt.rollback()
+                    await websocket.close(code=1011)
+                    return
+                except Exception:
+                    # Keep a failed turn out of the history
+                    prompt.rollback()
+                    raise
                 
             elif message_data.get("type") == "clear":
-                conversation_history = []
-                await websocket.send_json({"type": "cleared"})
+                prompt.clear()
+                await writer.send(ClearedChunk())
+                await writer.flush()
                 
     except WebSocketDisconnect:
         pass
     except Exception as e:
-        await websocket.send_json({
-            "type": "error",
-            "content": f"Error: {str(e)}"
-        })
+        # A failed writer means the socket can no longer be sent to
+        if not writer.failed:
+            await writer.send(ErrorChunk(f"Error: {str(e)}"))
+            await writer.flush()
+    finally:
+        manager.remove_tools_listener(on_tools_updated)
+        await writer.close()
 
 
 @app.get("/")
@@ -1,23 +1,41 @@
 """MCP Server Manager - Handles connections to MCP servers."""
 import json
 import asyncio
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple, Any
 from pathlib import Path
+from types import MappingProxyType
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 
+# How long a tool call waits for its server to finish connecting
+CONNECT_WAIT_TIMEOUT = 30.0
+
 
 class MCPManager:
     """Manages connections to multiple MCP servers."""
     
-    def __init__(self, config_path: str = "mcp_config.json"):
-        # Resolve config path relative to project root
+    def __init__(
+        self,
+        config_path: str = "mcp_config.json",
+        tools_cache_path: str = ".mcp_tools_cache.json",
+    ):
+        # Resolve config and cache paths relative to project root
         project_root = Path(__file__).parent.parent
         self.config_path = project_root / config_path
+        self.tools_cache_path = project_root / tools_cache_path
         self.sessions: Dict[str, ClientSession] = {}
         self.server_params: Dict[str, StdioServerParameters] = {}
         self.tools_cache: Dict[str, List[Dict[str, Any]]] = {}
-        self.transports: Dict[str, Any] = {}  # Store context managers
+        self._tools_view = MappingProxyType(self.tools_cache)
+        # Per-server task owning the connection, and the event that stops it
+        self._server_tasks: Dict[str, Tuple[asyncio.Task, asyncio.Event]] = {}
+        self._tools_version: int = 0  # Bumped whenever tools_cache changes
+        self._tool_index: Dict[str, str] = {}  # Tool name -> server name
+        self._connect_locks: Dict[str, asyncio.Lock] = {}
+        self._connecting: Set[str] = set()
+        # Last known tools per server, persisted across restarts
+        self._persisted_tools: Dict[str, List[Dict[str, Any]]] = {}
+        self._tools_listeners: List[Callable[[str], None]] = []
         
     def load_config(self) -> Dict[str, Any]:
         """Load MCP server configuration from JSON file."""
@@ -29,9 +47,25 @@ class MCPManager:
     
     async def connect_server(self, server_name: str, config: Dict[str, Any]) -> bool:
         """Connect to an MCP server."""
-        if server_name in self.sessions:
-            return True
-        
+        # Serialize connects per server so concurrent callers share one connection
+        lock = self._connect_locks.setdefault(server_name, asyncio.Lock())
+        async with lock:
+            if server_name in self.sessions:
+                return True
+            
+            self._connecting.add(server_name)
+            try:
+                connected = await self._connect_server(server_name, config)
+            finally:
+                self._connecting.discard(server_name)
+            
+            # Persisted tools of a server that failed to connect must not be offered
+            if not connected:
+                self._drop_tools(server_name)
+            return connected
+    
+    async def _connect_server(self, server_name: str, config: Dict[str, Any]) -> bool:
+        """Launch an MCP server and wait for its session to be ready."""
         try:
             command = config["command"]
             args = config.get("args", [])
@@ -40,61 +74,157 @@ class MCPManager:
                 command=command,
                 args=args,
             )
-            
-            self.server_params[server_name] = server_params
-            
-            # Create and store stdio client context manager
-            stdio_transport_cm = stdio_client(server_params)
-            read_stream, write_stream = await stdio_transport_cm.__aenter__()
-            
-            session = ClientSession(read_stream, write_stream)
-            await session.__aenter__()
-            await session.initialize()
-            
-            self.sessions[server_name] = session
-            self.transports[server_name] = (stdio_transport_cm, session)
-            await self._refresh_tools(server_name)
-            
-            return True
         except Exception as e:
             print(f"Error connecting to {server_name}: {e}")
             return False
+        
+        self.server_params[server_name] = server_params
+        
+        # The transport and session live in a dedicated task for their whole
+        # lifetime, since their cancel scopes must be exited by the same task
+        ready = asyncio.get_running_loop().create_future()
+        stop = asyncio.Event()
+        task = asyncio.create_task(self._run_server(server_name, server_params, ready, stop))
+        self._server_tasks[server_name] = (task, stop)
+        
+        try:
+            await ready
+        except asyncio.CancelledError:
+            # Wait for the server task so its transport is closed before we unwind
+            task.cancel()
+            del self._server_tasks[server_name]
+            del self.server_params[server_name]
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            raise
+        except Exception as e:
+            print(f"Error connecting to {server_name}: {e}")
+            await self.disconnect_server(server_name)
+            return False
+        
+        await self._refresh_tools(server_name)
+        return True
+    
+    async def _run_server(
+        self,
+        server_name: str,
+        server_params: StdioServerParameters,
+        ready: asyncio.Future,
+        stop: asyncio.Event,
+    ):
+        """Hold a server's transport and session open until `stop` is set."""
+        started = False
+        try:
+            async with stdio_client(server_params) as (read_stream, write_stream):
+                async with ClientSession(read_stream, write_stream) as session:
+                    await session.initialize()
+                    self.sessions[server_name] = session
+                    ready.set_result(None)
+                    started = True
+                    await stop.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                print(f"Server {server_name} exited: {e}")
+        finally:
+            self.sessions.pop(server_name, None)
+        
+        # A server that went away on its own is forgotten as if disconnected
+        if started and not stop.is_set():
+            del self._server_tasks[server_name]
+            self.server_params.pop(server_name, None)
+            self._drop_tools(server_name)
     
     async def disconnect_server(self, server_name: str):
         """Disconnect from an MCP server."""
-        if server_name in self.transports:
-            try:
-                stdio_transport_cm, session = self.transports[server_name]
-                await session.__aexit__(None, None, None)
-                await stdio_transport_cm.__aexit__(None, None, None)
-            except Exception as e:
-                print(f"Error disconnecting {server_name}: {e}")
-            del self.transports[server_name]
-        
-        if server_name in self.sessions:
-            del self.sessions[server_name]
+        if server_name in self._server_tasks:
+            task, stop = self._server_tasks.pop(server_name)
+            stop.set()
+            await task
+        
         if server_name in self.server_params:
             del self.server_params[server_name]
-        if server_name in self.tools_cache:
-            del self.tools_cache[server_name]
+        self._drop_tools(server_name)
+    
+    def _drop_tools(self, server_name: str):
+        """Remove a server's tools from the cache and tell listeners."""
+        if server_name not in self.tools_cache:
+            return
+        
+        del self.tools_cache[server_name]
+        self._rebuild_tool_index()
+        self._tools_version += 1
+        for listener in self._tools_listeners:
+            listener(server_name)
+    
+    async def disconnect_all(self):
+        """Disconnect from every server that has a running connection."""
+        await asyncio.gather(
+            *(self.disconnect_server(server_name) for server_name in list(self._server_tasks)),
+            return_exceptions=True,
+        )
+    
+    def _load_persisted_tools(self, server_names: Iterable[str]):
+        """Publish the last known tools of the given servers until they reconnect."""
+        if not self.tools_cache_path.exists():
+            return
+        
+        try:
+            with open(self.tools_cache_path, "r") as f:
+                self._persisted_tools = json.load(f)
+        except Exception as e:
+            print(f"Error loading tools cache: {e}")
+            return
+        
+        for server_name in server_names:
+            if server_name in self._persisted_tools and server_name not in self.tools_cache:
+                self.tools_cache[server_name] = self._persisted_tools[server_name]
+        self._rebuild_tool_index()
+        self._tools_version += 1
+    
+    def _save_persisted_tools(self):
+        """Write the last known tools of every server to disk."""
+        try:
+            with open(self.tools_cache_path, "w") as f:
+                json.dump(self._persisted_tools, f)
+        except Exception as e:
+            print(f"Error saving tools cache: {e}")
     
     async def connect_all(self):
         """Connect to all servers in configuration."""
-        config = self.load_config()
+        # This runs as a background task, so report failures here
+        try:
+            config = self.load_config()
+        except Exception as e:
+            print(f"Error loading MCP config: {e}")
+            return
         servers = config.get("servers", {})
         
-        for server_name, server_config in servers.items():
-            await self.connect_server(server_name, server_config)
+        # Serve cached tools right away; connecting replaces them with live ones
+        self._load_persisted_tools(servers)
+        
+        # Servers start independently, so launch them all at once
+        await asyncio.gather(
+            *(
+                self.connect_server(server_name, server_config)
+                for server_name, server_config in servers.items()
+            ),
+            return_exceptions=True,
+        )
     
     async def _refresh_tools(self, server_name: str):
         """Refresh tools cache for a server."""
         if server_name not in self.sessions:
             return
         
+        previous = self.tools_cache.get(server_name)
         try:
             session = self.sessions[server_name]
             tools_result = await session.list_tools()
-            self.tools_cache[server_name] = [
+            tools = [
                 {
                     "name": tool.name,
                     "description": tool.description,
@@ -104,18 +234,69 @@ class MCPManager:
             ]
         except Exception as e:
             print(f"Error refreshing tools for {server_name}: {e}")
-            self.tools_cache[server_name] = []
+            tools = []
+        else:
+            if tools != self._persisted_tools.get(server_name):
+                self._persisted_tools[server_name] = tools
+                self._save_persisted_tools()
+        
+        # Unchanged tools (e.g. matching the persisted ones) keep every cache valid
+        if tools == previous:
+            return
+        
+        self.tools_cache[server_name] = tools
+        self._rebuild_tool_index()
+        self._tools_version += 1
+        for listener in self._tools_listeners:
+            listener(server_name)
+    
+    def add_tools_listener(self, listener: Callable[[str], None]):
+        """Register a callback invoked with a server name when its tools change."""
+        self._tools_listeners.append(listener)
+    
+    def remove_tools_listener(self, listener: Callable[[str], None]):
+        """Unregister a callback added with add_tools_listener."""
+        self._tools_listeners.remove(listener)
+    
+    def _rebuild_tool_index(self):
+        """Rebuild the tool name -> server lookup; the first server to offer a tool wins."""
+        index: Dict[str, str] = {}
+        for server_name, tools in self.tools_cache.items():
+            for tool in tools:
+                index.setdefault(tool["name"], server_name)
+        self._tool_index = index
+    
+    def get_all_tools(self) -> Mapping[str, List[Dict[str, Any]]]:
+        """Get a read-only view of all tools from all connected servers."""
+        return self._tools_view
     
-    def get_all_tools(self) -> Dict[str, List[Dict[str, Any]]]:
-        """Get all tools from all connected servers."""
-        return self.tools_cache.copy()
+    def get_tools_version(self) -> int:
+        """Get a counter that changes whenever the tools cache changes."""
+        return self._tools_version
     
     def get_servers(self) -> List[str]:
         """Get list of connected server names."""
         return list(self.sessions.keys())
     
+    def get_connecting_servers(self) -> List[str]:
+        """Get list of servers whose connection is still in progress."""
+        return [name for name in self._connecting if name not in self.sessions]
+    
     async def call_tool(self, server_name: str, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
         """Call a tool on a specific MCP server."""
+        # Persisted tools are offered before their server is up, so wait for
+        # a connect in progress rather than failing the call
+        if server_name not in self.sessions and server_name in self._connecting:
+            lock = self._connect_locks[server_name]
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout=CONNECT_WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                return {
+                    "content": [{"type": "text", "text": f"Error: Server {server_name} is still connecting"}],
+                    "isError": True,
+                }
+            lock.release()
+        
         if server_name not in self.sessions:
             raise ValueError(f"Server {server_name} not connected")
         
@@ -141,10 +322,7 @@ class MCPManager:
     
     async def find_tool_server(self, tool_name: str) -> Optional[str]:
         """Find which server has a specific tool."""
-        for server_name, tools in self.tools_cache.items():
-            if any(tool["name"] == tool_name for tool in tools):
-                return server_name
-        return None
+        return self._tool_index.get(tool_name)
 
 
 # Global instance
@@ -1,8 +1,82 @@
 """OpenAI Handler - Manages streaming chat with tool calling."""
-import json
-from typing import AsyncGenerator, Dict, Any, List
-from openai import AsyncOpenAI
+import asyncio
+from contextlib import aclosing
+from typing import AsyncGenerator, Dict, Any, List, Optional, Tuple
+import orjson
+from openai import AsyncOpenAI, AsyncStream
+from chunks import AssistantChunk, Chunk, CompleteChunk, ToolCallChunk, ToolResultChunk
 from mcp_manager import get_manager
+from prompt_buffer import PromptBuffer
+
+# Upper bound on tool calls running at once for a single handler
+MAX_CONCURRENT_TOOL_CALLS = 8
+
+# Streamed assistant text is coalesced until either limit is reached
+ASSISTANT_FLUSH_CHARS = 256
+ASSISTANT_FLUSH_INTERVAL = 0.02  # seconds
+
+
+class ToolCallBuilder:
+    """Accumulates one tool call from streamed deltas."""
+    __slots__ = ("id", "name", "arg_parts", "arguments", "parsed")
+    
+    def __init__(self):
+        self.id = ""
+        self.name = ""
+        self.arg_parts: List[str] = []
+        self.arguments = ""
+        self.parsed: Any = None  # Parsed arguments, or the parse error
+    
+    def finish(self):
+        """Join the arguments streamed so far and parse them.
+        
+        The parts are kept, so finishing again after late deltas sees every fragment.
+        """
+        self.arguments = "".join(self.arg_parts)
+        try:
+            self.parsed = orjson.loads(self.arguments)
+        except orjson.JSONDecodeError as e:
+            self.parsed = e
+    
+    def to_message(self) -> Dict[str, Any]:
+        """Build the tool call entry of an assistant message."""
+        return {
+            "id": self.id,
+            "type": "function",
+            "function": {"name": self.name, "arguments": self.arguments},
+        }
+
+
+async def _iter_with_idle_ticks(
+    stream: AsyncStream,
+    interval: float,
+) -> AsyncGenerator[Optional[Any], None]:
+    """Iterate a stream, yielding None whenever it stays idle for `interval` seconds.
+    
+    The stream is closed when iteration stops, including when the consumer
+    abandons it early.
+    """
+    iterator = stream.__aiter__()
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=interval)
+            if not done:
+                yield None
+                continue
+            try:
+                item = pending.result()
+            except StopAsyncIteration:
+                return
+            finally:
+                pending = None
+            yield item
+    finally:
+        if pending is not None:
+            pending.cancel()
+        await stream.close()
 
 
 class OpenAIHandler:
@@ -12,34 +86,58 @@ class OpenAIHandler:
         self.client = AsyncOpenAI(api_key=api_key)
         self.model = "gpt-4o"
         self.manager = get_manager()
+        # (tools version, converted tools) from the last conversion
+        self._openai_tools_cache: Optional[Tuple[int, List[Dict[str, Any]]]] = None
+        # OpenAI function name -> (server name, MCP tool name)
+        self._tool_routes: Dict[str, Tuple[str, str]] = {}
+        self._tool_semaphore = asyncio.Semaphore(MAX_CONCURRENT_TOOL_CALLS)
     
     def _convert_mcp_tools_to_openai(self) -> List[Dict[str, Any]]:
         """Convert MCP tools to OpenAI function calling format."""
+        tools_version = self.manager.get_tools_version()
+        if self._openai_tools_cache is not None and self._openai_tools_cache[0] == tools_version:
+            return self._openai_tools_cache[1]
+        
         all_tools = self.manager.get_all_tools()
         openai_tools = []
+        tool_routes: Dict[str, Tuple[str, str]] = {}
         
         for server_name, tools in all_tools.items():
+            prefix = f"{server_name}__"
             for tool in tools:
+                function_name = prefix + tool["name"]
+                tool_routes[function_name] = (server_name, tool["name"])
                 openai_tool = {
                     "type": "function",
                     "function": {
-                        "name": f"{server_name}__{tool['name']}",
+                        "name": function_name,
                         "description": tool.get("description", ""),
                         "parameters": tool.get("inputSchema", {}),
                     }
                 }
                 openai_tools.append(openai_tool)
         
+        self._openai_tools_cache = (tools_version, openai_tools)
+        self._tool_routes = tool_routes
         return openai_tools
     
+    async def _call_tool(
+        self, server_name: str, tool_name: str, arguments: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Call an MCP tool, bounded by the handler's concurrency limit."""
+        async with self._tool_semaphore:
+            return await self.manager.call_tool(server_name, tool_name, arguments)
+    
     async def process_message(
         self, 
-        conversation_history: List[Dict[str, Any]]
-    ) -> AsyncGenerator[Dict[str, Any], None]:
-        """Process a user message with streaming and tool calling."""
-        # conversation_history should already include the user message
-        messages = conversation_history.copy()
+        prompt: PromptBuffer
+    ) -> AsyncGenerator[Chunk, None]:
+        """Process a user message with streaming and tool calling.
         
+        The user message should already be staged in `prompt`. Assistant and
+        tool messages are staged as they are produced and committed once the
+        turn completes.
+        """
         mcp_tools = self._convert_mcp_tools_to_openai()
         
         # Main loop: continue until we get a final response
@@ -47,140 +145,180 @@ class OpenAIHandler:
             # Stream the completion
             stream = await self.client.chat.completions.create(
                 model=self.model,
-                messages=messages,
+                messages=prompt.messages,
                 tools=mcp_tools if mcp_tools else None,
                 stream=True,
             )
             
-            assistant_message = {"role": "assistant", "content": "", "tool_calls": []}
             finish_reason = None
-            current_tool_call = None
             
-            async for chunk in stream:
-                delta = chunk.choices[0].delta
-                finish_reason = chunk.choices[0].finish_reason
-                
-                # Handle content
-                if delta.content:
-                    assistant_message["content"] += delta.content
-                    yield {
-                        "type": "assistant",
-                        "content": delta.content,
-                    }
-                
-                # Handle tool calls
-                if delta.tool_calls:
-                    for tool_call_delta in delta.tool_calls:
-                        index = tool_call_delta.index
-                        
-                        # Initialize tool call if needed
-                        while len(assistant_message["tool_calls"]) <= index:
-                            assistant_message["tool_calls"].append({
-                                "id": "",
-                                "type": "function",
-                                "function": {"name": "", "arguments": ""}
-                            })
-                        
-                        tool_call = assistant_message["tool_calls"][index]
-                        
-                        if tool_call_delta.id:
-                            tool_call["id"] = tool_call_delta.id
+            # Streamed text is joined once the stream ends; tool arguments are
+            # joined and parsed as soon as each call is complete
+            content_parts: List[str] = []
+            tool_builders: Dict[int, ToolCallBuilder] = {}
+            open_index: Optional[int] = None  # Tool call whose arguments are streaming
+            
+            # Pending assistant text not yet sent to the client
+            content_buffer: List[str] = []
+            buffered_chars = 0
+            buffer_started = 0.0
+            loop = asyncio.get_running_loop()
+            
+            ticks = _iter_with_idle_ticks(stream, ASSISTANT_FLUSH_INTERVAL)
+            async with aclosing(ticks) as chunks:
+                async for chunk in chunks:
+                    # Stream went idle: flush whatever text we are holding
+                    if chunk is None:
+                        if content_buffer:
+                            yield AssistantChunk("".join(content_buffer))
+                            content_buffer.clear()
+                            buffered_chars = 0
+                        continue
+                    
+                    delta = chunk.choices[0].delta
+                    finish_reason = chunk.choices[0].finish_reason
+                    
+                    # Handle content
+                    if delta.content:
+                        content_parts.append(delta.content)
+                        if not content_buffer:
+                            buffer_started = loop.time()
+                        content_buffer.append(delta.content)
+                        buffered_chars += len(delta.content)
+                        if (
+                            buffered_chars >= ASSISTANT_FLUSH_CHARS
+                            or loop.time() - buffer_started >= ASSISTANT_FLUSH_INTERVAL
+                        ):
+                            yield AssistantChunk("".join(content_buffer))
+                            content_buffer.clear()
+                            buffered_chars = 0
+                    
+                    # Handle tool calls
+                    if delta.tool_calls:
+                        # Keep text ordered ahead of any tool call events
+                        if content_buffer:
+                            yield AssistantChunk("".join(content_buffer))
+                            content_buffer.clear()
+                            buffered_chars = 0
                         
-                        if tool_call_delta.function:
-                            if tool_call_delta.function.name:
-                                tool_call["function"]["name"] = tool_call_delta.function.name
+                        for tool_call_delta in delta.tool_calls:
+                            index = tool_call_delta.index
+                            
+                            # Tool calls stream one after another, so a new index
+                            # means the previous call's arguments are complete
+                            if open_index is not None and index != open_index:
+                                tool_builders[open_index].finish()
+                            open_index = index
                             
-                            if tool_call_delta.function.arguments:
-                                tool_call["function"]["arguments"] += tool_call_delta.function.arguments
+                            builder = tool_builders.get(index)
+                            if builder is None:
+                                builder = tool_builders[index] = ToolCallBuilder()
+                            
+                            # Announce each call once, when its id first arrives
+                            announce = bool(tool_call_delta.id) and not builder.id
+                            if tool_call_delta.id:
+                                builder.id = tool_call_delta.id
+                            
+                            if tool_call_delta.function:
+                                if tool_call_delta.function.name:
+                                    builder.name = tool_call_delta.function.name
                                 
-                                # Stream tool call info
-                                if not current_tool_call or current_tool_call["name"] != tool_call["function"]["name"]:
-                                    current_tool_call = {
-                                        "name": tool_call["function"]["name"],
-                                        "arguments": tool_call["function"]["arguments"]
-                                    }
-                                    yield {
-                                        "type": "tool_call",
-                                        "content": f"Calling tool: {tool_call['function']['name']}",
-                                        "metadata": {
-                                            "tool_name": tool_call["function"]["name"],
-                                            "args": tool_call["function"]["arguments"]
-                                        }
-                                    }
+                                if tool_call_delta.function.arguments:
+                                    builder.arg_parts.append(tool_call_delta.function.arguments)
+                            
+                            if announce:
+                                yield ToolCallChunk(
+                                    content=f"Calling tool: {builder.name}",
+                                    metadata={"tool_name": builder.name},
+                                )
             
-            # Add assistant message to history
-            messages.append(assistant_message)
+            if content_buffer:
+                yield AssistantChunk("".join(content_buffer))
             
-            # If no tool calls, we're done
-            if finish_reason != "tool_calls" or not assistant_message.get("tool_calls"):
+            if open_index is not None:
+                tool_builders[open_index].finish()
+            
+            assistant_message: Dict[str, Any] = {"role": "assistant", "content": "".join(content_parts)}
+            builders = [tool_builders[index] for index in sorted(tool_builders)]
+            
+            # If no tool calls, we're done; unanswered tool calls are left out
+            # since they would make the stored history invalid
+            if finish_reason != "tool_calls" or not builders:
+                await prompt.stage(assistant_message)
+                prompt.commit()
+                
                 # Send completion signal
-                yield {
-                    "type": "complete",
-                    "content": "",
-                }
+                yield CompleteChunk()
                 break
             
-            # Execute tool calls
-            for tool_call in assistant_message["tool_calls"]:
-                tool_name_full = tool_call["function"]["name"]
-                tool_args_str = tool_call["function"]["arguments"]
+            assistant_message["tool_calls"] = [builder.to_message() for builder in builders]
+            await prompt.stage(assistant_message)
+            
+            # Resolve every tool call up front so they can run concurrently
+            prepared: List[Any] = []  # (server, tool, args) per call, or the resolution error
+            for builder in builders:
+                tool_name_full = builder.name
                 
                 try:
-                    # Parse tool name (format: server__tool)
-                    if "__" not in tool_name_full:
-                        raise ValueError(f"Invalid tool name format: {tool_name_full}")
-                    
-                    server_name, actual_tool_name = tool_name_full.split("__", 1)
-                    tool_args = json.loads(tool_args_str)
-                    
-                    # Execute tool
-                    yield {
-                        "type": "tool_result",
-                        "content": f"Executing {actual_tool_name} on {server_name}...",
-                        "metadata": {
-                            "tool_name": actual_tool_name,
-                            "server_name": server_name,
-                        }
-                    }
-                    
-                    result = await self.manager.call_tool(server_name, actual_tool_name, tool_args)
-                    
-                    # Format result
-                    result_text = "\n".join([
-                        item.get("text", str(item))
-                        for item in result.get("content", [])
-                    ])
-                    
-                    if result.get("isError"):
-                        result_text = f"Error: {result_text}"
-                    
-                    yield {
-                        "type": "tool_result",
-                        "content": f"Result from {actual_tool_name}: {result_text}",
-                        "metadata": {
-                            "tool_name": actual_tool_name,
-                            "result": result_text,
-                        }
-                    }
-                    
-                    # Add tool result to messages
-                    messages.append({
-                        "role": "tool",
-                        "content": result_text,
-                        "tool_call_id": tool_call["id"],
-                    })
+                    # Map the OpenAI function name back to its server and tool
+                    if tool_name_full not in self._tool_routes:
+                        raise ValueError(f"Unknown tool: {tool_name_full}")
                     
+                    server_name, actual_tool_name = self._tool_routes[tool_name_full]
+                    tool_args = builder.parsed
+                    if isinstance(tool_args, Exception):
+                        raise tool_args
                 except Exception as e:
-                    error_msg = f"Error executing tool {tool_name_full}: {str(e)}"
-                    yield {
-                        "type": "tool_result",
-                        "content": error_msg,
-                        "metadata": {"error": str(e)},
-                    }
+                    prepared.append(e)
+                    continue
+                
+                prepared.append((server_name, actual_tool_name, tool_args))
+                yield ToolResultChunk(
+                    content=f"Executing {actual_tool_name} on {server_name}...",
+                    metadata={
+                        "tool_name": actual_tool_name,
+                        "server_name": server_name,
+                    },
+                )
+            
+            # Execute tool calls; results come back in call order
+            results = iter(await asyncio.gather(
+                *(self._call_tool(*target) for target in prepared if not isinstance(target, Exception)),
+                return_exceptions=True,
+            ))
+            
+            for builder, target in zip(builders, prepared):
+                result = target if isinstance(target, Exception) else next(results)
+                
+                if isinstance(result, BaseException):
+                    error_msg = f"Error executing tool {builder.name}: {str(result)}"
+                    yield ToolResultChunk(content=error_msg, metadata={"error": str(result)})
                     
-                    messages.append({
+                    await prompt.stage({
                         "role": "tool",
                         "content": error_msg,
-                        "tool_call_id": tool_call["id"],
+                        "tool_call_id": builder.id,
                     })
-
+                    continue
+                
+                _, actual_tool_name, _ = target
+                
+                # Format result
+                result_text = "\n".join([
+                    item.get("text", str(item))
+                    for item in result.get("content", [])
+                ])
+                
+                if result.get("isError"):
+                    result_text = f"Error: {result_text}"
+                
+                # The UI labels results by tool_name, so the output is sent once
+                # as-is rather than embedded in a new formatted string
+                yield ToolResultChunk(content=result_text, metadata={"tool_name": actual_tool_name})
+                
+                # Add tool result to the prompt
+                await prompt.stage({
+                    "role": "tool",
+                    "content": result_text,
+                    "tool_call_id": builder.id,
+                })
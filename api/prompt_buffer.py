@@ -0,0 +1,161 @@
+"""Prompt Buffer - Append-only conversation history for OpenAI requests."""
+import asyncio
+from typing import Any, Dict, List, Optional
+import tiktoken
+
+# Compaction kicks in above the limit and trims history down to the target,
+# so the stable prefix only changes once in a while rather than every turn
+DEFAULT_MAX_TOKENS = 100_000
+COMPACTION_TARGET_RATIO = 0.75
+
+# Rough per-message overhead for role and separators
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# Estimate used when no tokenizer is loaded for the model
+CHARS_PER_TOKEN = 4
+
+# Messages longer than this are tokenized in a worker thread
+THREADED_TOKENIZE_CHARS = 32_768
+
+# Tokenizers loaded by load_encoding; None marks a model whose load failed
+_encodings: Dict[str, Optional[tiktoken.Encoding]] = {}
+
+
+async def load_encoding(model: str = "gpt-4o"):
+    """Load the tokenizer for a model off the event loop.
+
+    tiktoken may download the encoding on first use. If that fails, token
+    counts for the model fall back to a character-based estimate.
+    """
+    if model in _encodings:
+        return
+    try:
+        _encodings[model] = await asyncio.to_thread(tiktoken.encoding_for_model, model)
+    except Exception as e:
+        print(f"Error loading tokenizer for {model}, estimating token counts: {e}")
+        _encodings[model] = None
+
+
+def _message_texts(message: Dict[str, Any]) -> List[str]:
+    """Collect the strings of a message that count towards the prompt."""
+    texts = []
+    content = message.get("content")
+    if isinstance(content, str):
+        texts.append(content)
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call["function"]
+        texts.append(function["name"])
+        texts.append(function["arguments"])
+    return texts
+
+
+def count_message_tokens(message: Dict[str, Any], model: str = "gpt-4o") -> int:
+    """Approximate the number of prompt tokens a message takes up.
+
+    Never loads a tokenizer itself; models without one loaded are estimated.
+    """
+    encoding = _encodings.get(model)
+    tokens = MESSAGE_TOKEN_OVERHEAD
+    for text in _message_texts(message):
+        if encoding is None:
+            tokens += len(text) // CHARS_PER_TOKEN
+        else:
+            tokens += len(encoding.encode_ordinary(text))
+    return tokens
+
+
+class PromptBuffer:
+    """Append-only message list shared by reference across conversation turns.
+
+    Messages are staged while a turn is in progress and committed once it
+    completes. Committed messages are never rewritten, so each request sends
+    a byte-identical prefix of the previous one. Once the history grows past
+    `max_tokens`, the oldest whole turns are dropped at commit time.
+    """
+
+    def __init__(self, max_tokens: int = DEFAULT_MAX_TOKENS, model: str = "gpt-4o"):
+        self.max_tokens = max_tokens
+        self.model = model
+        self._messages: List[Dict[str, Any]] = []
+        self._token_counts: List[int] = []  # Parallel to _messages
+        self._total_tokens = 0
+        self._committed = 0  # Number of messages that belong to finished turns
+
+    @property
+    def messages(self) -> List[Dict[str, Any]]:
+        """Committed messages followed by the current turn's staged messages."""
+        return self._messages
+
+    @property
+    def total_tokens(self) -> int:
+        """Approximate token count of all messages in the buffer."""
+        return self._total_tokens
+
+    async def stage(self, message: Dict[str, Any]):
+        """Append a message to the turn in progress."""
+        # Large messages, typically tool results, are tokenized off the event loop
+        if sum(len(text) for text in _message_texts(message)) > THREADED_TOKENIZE_CHARS:
+            tokens = await asyncio.to_thread(count_message_tokens, message, self.model)
+        else:
+            tokens = count_message_tokens(message, self.model)
+        self._messages.append(message)
+        self._token_counts.append(tokens)
+        self._total_tokens += tokens
+
+    def commit(self):
+        """Make the staged messages part of the stable history.
+
+        This is the only point where the history is compacted, so a tool
+        calling cycle is never split.
+        """
+        self._committed = len(self._messages)
+        if self._total_tokens > self.max_tokens:
+            self._compact(int(self.max_tokens * COMPACTION_TARGET_RATIO))
+
+    def rollback(self):
+        """Drop messages staged since the last commit."""
+        self._total_tokens -= sum(self._token_counts[self._committed:])
+        del self._messages[self._committed:]
+        del self._token_counts[self._committed:]
+
+    def clear(self):
+        """Forget the whole conversation."""
+        self._messages.clear()
+        self._token_counts.clear()
+        self._total_tokens = 0
+        self._committed = 0
+
+    def _compact(self, target_tokens: int):
+        """Drop the oldest turns until the buffer fits `target_tokens`.
+
+        Whole turns (a user message up to the next one) are removed together so
+        assistant tool calls always keep their matching tool results. System
+        messages and the most recent turn are always kept.
+        """
+        turn_starts = [
+            i for i, message in enumerate(self._messages) if message.get("role") == "user"
+        ]
+        if len(turn_starts) < 2:
+            return
+
+        first = turn_starts[0]
+        last = first
+        remaining = self._total_tokens
+        for start, next_start in zip(turn_starts, turn_starts[1:]):
+            if remaining <= target_tokens:
+                break
+            remaining -= sum(
+                self._token_counts[i]
+                for i in range(start, next_start)
+                if self._messages[i].get("role") != "system"
+            )
+            last = next_start
+
+        if last == first:
+            return
+
+        kept = [i for i in range(first, last) if self._messages[i].get("role") == "system"]
+        self._messages[first:last] = [self._messages[i] for i in kept]
+        self._token_counts[first:last] = [self._token_counts[i] for i in kept]
+        self._total_tokens = remaining
+        self._committed = len(self._messages)
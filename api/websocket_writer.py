@@ -0,0 +1,89 @@
+"""WebSocket Writer - Decouples chunk production from WebSocket sends."""
+import asyncio
+from typing import List, Optional
+from fastapi import WebSocket
+from chunks import AssistantChunk, Chunk, encode_chunk
+
+# Maximum number of chunks waiting to be written to the client
+SEND_QUEUE_SIZE = 512
+
+
+class WebSocketWriter:
+    """Sends chunks to a WebSocket from a dedicated background task.
+
+    Producers hand chunks to `send` and go straight back to consuming the
+    upstream stream. When the queue is full, assistant text is coalesced
+    locally instead of waiting for the client; other chunks wait for room.
+    """
+
+    def __init__(self, websocket: WebSocket, send_timeout: float, maxsize: int = SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.send_timeout = send_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self._overflow: List[str] = []  # Assistant text waiting for queue space
+        self._error: Optional[Exception] = None
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        """Drain the queue to the WebSocket until cancelled."""
+        while True:
+            chunk = await self._queue.get()
+            try:
+                # Once a send has failed, keep draining so producers never block
+                if self._error is None:
+                    await asyncio.wait_for(
+                        self.websocket.send_bytes(encode_chunk(chunk)),
+                        timeout=self.send_timeout,
+                    )
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    @property
+    def failed(self) -> bool:
+        """Whether a send has failed; later chunks are dropped."""
+        return self._error is not None
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    async def send(self, chunk: Chunk):
+        """Queue a chunk for sending, raising if an earlier send failed."""
+        self._raise_if_failed()
+
+        if isinstance(chunk, AssistantChunk):
+            self._overflow.append(chunk.content)
+            if not self._queue.full():
+                self._queue.put_nowait(AssistantChunk("".join(self._overflow)))
+                self._overflow.clear()
+            return
+
+        await self._drain_overflow()
+        await self._queue.put(chunk)
+
+    def post(self, chunk: Chunk):
+        """Queue an advisory chunk without waiting; it is dropped if the queue is full."""
+        if self._error is None and not self._queue.full():
+            self._queue.put_nowait(chunk)
+
+    async def _drain_overflow(self):
+        """Queue any coalesced assistant text, waiting for room if needed."""
+        if self._overflow:
+            await self._queue.put(AssistantChunk("".join(self._overflow)))
+            self._overflow.clear()
+
+    async def flush(self):
+        """Wait until every queued chunk has been written."""
+        await self._drain_overflow()
+        await self._queue.join()
+        self._raise_if_failed()
+
+    async def close(self):
+        """Stop the background task, dropping anything still queued."""
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
@@ -19,14 +19,19 @@ function App() {
 
     // Connect WebSocket
     const ws = new WebSocket(WS_URL);
+    ws.binaryType = "arraybuffer";
     wsRef.current = ws;
+    const decoder = new TextDecoder();
 
     ws.onopen = () => {
       console.log("WebSocket connected");
     };
 
     ws.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+      // The server sends UTF-8 JSON in binary frames
+      const raw =
+        typeof event.data === "string" ? event.data : decoder.decode(event.data);
+      const data = JSON.parse(raw);
 
       if (data.type === "error") {
         addMessage({
@@ -40,6 +45,11 @@ function App() {
         return;
       }
 
+      if (data.type === "tools_updated") {
+        fetchServers();
+        return;
+      }
+
       if (data.type === "complete") {
         setIsStreaming(false);
         currentMessageRef.current = null;
@@ -110,6 +120,10 @@ function App() {
       const response = await fetch(`${API_URL}/api/servers`);
       const data = await response.json();
       setServers(data.servers || []);
+      // Servers connect in the background; poll until they have all settled
+      if (data.servers?.some((server: MCPServer) => server.connecting)) {
+        setTimeout(fetchServers, 1000);
+      }
     } catch (error) {
       console.error("Error fetching servers:", error);
     }
@@ -54,7 +54,11 @@ export function ServerSidebar({ servers }: ServerSidebarProps) {
                     </div>
                     <div
                       className={`h-2 w-2 rounded-full ${
-                        server.connected ? "bg-green-500" : "bg-red-500"
+                        server.connected
+                          ? "bg-green-500"
+                          : server.connecting
+                            ? "bg-yellow-500"
+                            : "bg-red-500"
                       }`}
                     />
                   </div>
@@ -15,6 +15,7 @@ export interface Message {
 export interface MCPServer {
   name: string;
   connected: boolean;
+  connecting?: boolean;
   tools: MCPTool[];
 }
 